@@ -0,0 +1,401 @@
+"""
+Shared HTTP transport for the Authentik helper scripts.
+
+urllib.request closes the socket after every call, so each API request paid a
+fresh TCP handshake and TLS negotiation. This module keeps a small pool of
+persistent HTTP/1.1 connections per host instead, and retries idempotent
+requests on transient gateway errors and any request that was rate limited
+(429), honouring Retry-After. Only the standard library is used so the
+scripts keep running with a bare python3 (control node or authentik-server).
+"""
+
+import concurrent.futures
+import email.utils
+import functools
+import gzip
+import hashlib
+import http.client
+import ipaddress
+import json
+import os
+import random
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+import zlib
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used otherwise
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional; list lookups then parse the whole body
+    ijson = None
+
+# Raised while reading a list body: a malformed or cut-short gzip stream
+# (EOFError, zlib.error) and, when streaming, ijson's parse errors, which do
+# not subclass ValueError
+_STREAM_ERRORS: Tuple[type, ...] = (ValueError, EOFError, zlib.error)
+if ijson is not None:
+    _STREAM_ERRORS += (ijson.JSONError,)
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# Mirrors urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.2
+RETRY_STATUSES = frozenset({502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'})
+# A 429 is rejected before the request is processed, so any method may be resent
+RATE_LIMIT_STATUS = 429
+MAX_BACKOFF = 60
+# X-RateLimit-Reset values above this are absolute epoch seconds, not a delta
+EPOCH_THRESHOLD = 10 ** 9
+
+POOL_MAXSIZE = 4
+
+# Optional SHA-256 fingerprint of the Authentik leaf certificate. When set, the
+# presented certificate must match it exactly, replacing chain/hostname checks.
+CERT_SHA256 = os.environ.get('AUTHENTIK_CERT_SHA256', '').replace(':', '').lower() or None
+
+
+def loopback_url(base_url: str, port: int) -> str:
+    """
+    Return http://127.0.0.1:<port> if base_url's host resolves to loopback.
+
+    TLS buys nothing on a loopback socket, so talking to Authentik's internal
+    plaintext port skips the handshake entirely. Any other host is returned
+    unchanged.
+    """
+    host = urllib.parse.urlsplit(base_url).hostname
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (socket.gaierror, UnicodeError):
+        return base_url
+    if addresses and all(ipaddress.ip_address(a.split('%')[0]).is_loopback for a in addresses):
+        return f'http://127.0.0.1:{port}'
+    return base_url
+
+
+def base_headers(token: Optional[str] = None) -> Dict[str, str]:
+    """Headers for every API request; build once and reuse the dict."""
+    headers = {
+        'Content-Type': 'application/json',
+        # List endpoints compress 5-10x; responses are decompressed in _read()
+        'Accept-Encoding': 'gzip',
+    }
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    return headers
+
+
+_DEFAULT_HEADERS = base_headers()
+
+
+class ConnectionPool:
+    """Idle keep-alive connections, keyed by (scheme, host:port, verify)."""
+
+    def __init__(self, maxsize: int = POOL_MAXSIZE):
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme: str, netloc: str,
+            verify: bool) -> Tuple[http.client.HTTPConnection, bool]:
+        """Return (connection, reused) for the given host."""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc, verify))
+            if idle:
+                return idle.pop(), True
+        return _new_connection(scheme, netloc, verify), False
+
+    def put(self, scheme: str, netloc: str, verify: bool,
+            conn: http.client.HTTPConnection) -> None:
+        """Return a connection to the pool, closing it if the pool is full."""
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc, verify), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+_POOL = ConnectionPool()
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context(verify: bool) -> ssl.SSLContext:
+    """Build each SSL context once; loading the system trust store is not free."""
+    ctx = ssl.create_default_context()
+    if not verify:
+        # Internal deployments use self-signed / not-yet-issued certificates
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+def _new_connection(scheme: str, netloc: str, verify: bool) -> http.client.HTTPConnection:
+    if scheme == 'https':
+        # A pinned fingerprint is checked below, so the chain walk is skipped
+        ctx = _ssl_context(verify and not CERT_SHA256)
+        conn = http.client.HTTPSConnection(netloc, timeout=CONNECT_TIMEOUT, context=ctx)
+    else:
+        conn = http.client.HTTPConnection(netloc, timeout=CONNECT_TIMEOUT)
+    conn.connect()
+    if scheme == 'https' and CERT_SHA256:
+        leaf = conn.sock.getpeercert(binary_form=True)
+        if hashlib.sha256(leaf).hexdigest() != CERT_SHA256:
+            conn.close()
+            raise ssl.SSLCertVerificationError(
+                ssl.SSL_ERROR_SSL, f'certificate fingerprint mismatch for {netloc}')
+    conn.sock.settimeout(READ_TIMEOUT)
+    return conn
+
+
+def _body_stream(response: http.client.HTTPResponse) -> IO[bytes]:
+    if response.getheader('Content-Encoding', '').lower() == 'gzip':
+        return gzip.GzipFile(fileobj=response)
+    return response
+
+
+def _read(response: http.client.HTTPResponse) -> bytes:
+    body = response.read()
+    if body and response.getheader('Content-Encoding', '').lower() == 'gzip':
+        return gzip.decompress(body)
+    return body
+
+
+def _encode(data: Dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode('utf-8')
+
+
+def _decode(body: bytes) -> Dict:
+    if not body:
+        return {}
+    try:
+        # Both parsers accept bytes directly, avoiding a decoded str copy
+        return orjson.loads(body) if orjson is not None else json.loads(body)
+    except ValueError:
+        return {'error': body.decode('utf-8', errors='replace')}
+
+
+class _Lease:
+    """A pooled connection checked out for a single response."""
+
+    def __init__(self, key: Tuple[str, str, bool], conn: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse):
+        self.key = key
+        self.conn = conn
+        self.response = response
+
+    def release(self, reusable: bool = True) -> None:
+        """Return the connection to the pool, or close it if it cannot be reused."""
+        if reusable and not self.response.will_close:
+            try:
+                # Drain what the caller did not read so the socket can be reused
+                self.response.read()
+            except (OSError, http.client.HTTPException):
+                reusable = False
+        else:
+            reusable = False
+
+        if reusable:
+            _POOL.put(*self.key, self.conn)
+        else:
+            self.conn.close()
+
+    def __enter__(self) -> http.client.HTTPResponse:
+        return self.response
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release(reusable=exc_type is None)
+
+
+def _retry_delay(response: http.client.HTTPResponse, attempt: int) -> float:
+    """
+    Seconds to wait before resending after a 429/5xx response.
+
+    Honours Retry-After (delta-seconds or HTTP-date) and X-RateLimit-Reset
+    (delta or epoch seconds); otherwise backs off exponentially with jitter so
+    concurrent callers do not retry in lockstep.
+    """
+    for name in ('Retry-After', 'X-RateLimit-Reset'):
+        value = response.headers.get(name)
+        if not value:
+            continue
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                continue
+        else:
+            if delay > EPOCH_THRESHOLD:
+                delay -= time.time()
+        return min(MAX_BACKOFF, max(0.0, delay))
+    return min(MAX_BACKOFF, BACKOFF_FACTOR * (2 ** attempt) + random.random() * BACKOFF_FACTOR)
+
+
+def _open(method: str, url: str, data: Optional[Dict], headers: Optional[Dict],
+          verify: bool, retries: int = MAX_RETRIES) -> _Lease:
+    """
+    Send a request over a pooled connection, retrying transient failures.
+
+    Returns a lease whose response body is still unread; use it as a context
+    manager so the connection goes back to the pool afterwards. Raises OSError
+    or http.client.HTTPException when retries are exhausted.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path = f'{path}?{parts.query}'
+    key = (parts.scheme, parts.netloc, verify)
+
+    body = _encode(data) if data else None
+    # Passed through as-is: callers reuse one prebuilt dict for every request
+    req_headers = headers if headers is not None else _DEFAULT_HEADERS
+
+    attempt = 0
+    while True:
+        conn = None
+        reused = False
+        sent = False
+        try:
+            conn, reused = _POOL.get(*key)
+            conn.request(method, path, body=body, headers=req_headers)
+            sent = True
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            if conn is not None:
+                conn.close()
+            # A reused keep-alive socket the server closed while idle fails
+            # before any response byte: sending breaks, or the reply is an
+            # immediate EOF. Only then is a write known not to have been
+            # processed; a timeout or a reset mid-response proves nothing.
+            stale = reused and (isinstance(e, http.client.RemoteDisconnected)
+                                or (not sent and isinstance(e, (BrokenPipeError, ConnectionResetError))))
+            if (stale or method in IDEMPOTENT_METHODS) and attempt < retries:
+                if not stale:
+                    time.sleep(BACKOFF_FACTOR * (2 ** attempt))
+                attempt += 1
+                continue
+            raise
+
+        lease = _Lease(key, conn, response)
+        retryable = (response.status == RATE_LIMIT_STATUS
+                     or (response.status in RETRY_STATUSES and method in IDEMPOTENT_METHODS))
+        if retryable and attempt < retries:
+            lease.release()
+            time.sleep(_retry_delay(response, attempt))
+            attempt += 1
+            continue
+
+        return lease
+
+
+def request(method: str, url: str, data: Optional[Dict] = None,
+            headers: Optional[Dict] = None, verify: bool = True,
+            retries: int = MAX_RETRIES) -> Tuple[int, Dict, http.client.HTTPMessage]:
+    """
+    Send a request over a pooled connection.
+
+    Returns (status, decoded JSON body, response headers). Network failures are
+    reported as status 0 with an 'error' key, like the previous urllib callers.
+    Pass retries=0 for callers that run their own retry loop.
+    """
+    try:
+        with _open(method, url, data, headers, verify, retries) as response:
+            response_body = _read(response)
+    except (OSError, http.client.HTTPException, EOFError, zlib.error) as e:
+        return 0, {'error': str(e)}, http.client.HTTPMessage()
+
+    return response.status, _decode(response_body), response.headers
+
+
+def find(method: str, url: str, predicate: Callable[[Dict], bool],
+         headers: Optional[Dict] = None, verify: bool = True) -> Tuple[int, Optional[Dict]]:
+    """
+    Return the first item of a list response's 'results' matching predicate.
+
+    With ijson installed the body is parsed incrementally and parsing stops at
+    the first match, so large listings are never materialized in memory.
+    Returns (status, item or None); on a non-200 status the second element is
+    the decoded error body, as with request().
+    """
+    try:
+        with _open(method, url, None, headers, verify) as response:
+            if response.status != 200 or ijson is None:
+                data = _decode(_read(response))
+                if response.status != 200:
+                    return response.status, data
+                return 200, next((i for i in data.get('results', []) if predicate(i)), None)
+
+            return 200, next((i for i in ijson.items(_body_stream(response), 'results.item') if predicate(i)), None)
+    except (OSError, http.client.HTTPException) + _STREAM_ERRORS as e:
+        return 0, {'error': str(e)}
+
+
+class Client:
+    """Authentik API client bound to one base URL, shared by all helper scripts."""
+
+    def __init__(self, base_url: str, token: Optional[str] = None, verify: bool = True):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.verify = verify
+        self._headers = base_headers(token)
+
+    def send(self, method: str, path: str, data: Optional[Dict] = None,
+             headers: Optional[Dict] = None,
+             retries: int = MAX_RETRIES) -> Tuple[int, Dict, http.client.HTTPMessage]:
+        """Make an API request, returning (status, decoded JSON body, response headers)."""
+        req_headers = {**self._headers, **headers} if headers else self._headers
+        return request(method, f'{self.base_url}{path}', data, req_headers,
+                       verify=self.verify, retries=retries)
+
+    def request(self, method: str, path: str, data: Optional[Dict] = None) -> Tuple[int, Dict]:
+        """Make an API request, returning (status, decoded JSON body)."""
+        status, response_data, _ = self.send(method, path, data)
+        return status, response_data
+
+    def get(self, path: str) -> Tuple[int, Dict]:
+        return self.request('GET', path)
+
+    def post(self, path: str, data: Dict) -> Tuple[int, Dict]:
+        return self.request('POST', path, data)
+
+    def patch(self, path: str, data: Dict) -> Tuple[int, Dict]:
+        return self.request('PATCH', path, data)
+
+    def find(self, path: str, predicate: Callable[[Dict], bool]) -> Tuple[int, Optional[Dict]]:
+        """Return (status, first listed item matching predicate); see find()."""
+        return find('GET', f'{self.base_url}{path}', predicate, self._headers, verify=self.verify)
+
+
+def run_concurrently(*calls: Callable[[], Any]) -> List[Any]:
+    """
+    Run independent API calls in parallel threads, returning results in order.
+
+    Each call gets its own pooled keep-alive connection, so total latency is
+    bounded by the slowest call instead of their sum. The first exception (in
+    argument order) is re-raised.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(calls), POOL_MAXSIZE)) as executor:
+        futures = [executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
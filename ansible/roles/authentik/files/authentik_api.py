@@ -12,83 +12,81 @@ Usage:
                              --app-name Nextcloud \
                              --redirect-uri https://nextcloud.example.com/apps/user_oidc/code \
                              --bootstrap-password <admin_password>
+
+Pass --flow-uuid / --key-uuid (from a previous run's output) to skip looking
+up the authorization flow and signing key.
 """
 
 import argparse
+import contextlib
+import hashlib
 import json
+import os
 import sys
 import time
-import urllib.request
-import urllib.error
+from datetime import datetime
 from typing import Dict, Optional, Tuple
 
+import _authentik_client
 
-class AuthentikAPI:
-    """Client for Authentik API with bootstrapping support."""
-
-    def __init__(self, base_url: str, token: Optional[str] = None):
-        self.base_url = base_url.rstrip('/')
-        self.token = token
-        self.session_cookie = None
-
-    def _request(self, method: str, path: str, data: Optional[Dict] = None,
-                 headers: Optional[Dict] = None) -> Tuple[int, Dict]:
-        """Make HTTP request to Authentik API."""
-        import ssl
-        url = f"{self.base_url}{path}"
-        req_headers = headers or {}
 
-        # Add authentication
-        if self.token:
-            req_headers['Authorization'] = f'Bearer {self.token}'
-        elif self.session_cookie:
-            req_headers['Cookie'] = self.session_cookie
+# Service account tokens are reused across runs instead of minting a new one each time
+TOKEN_CACHE_DIR = os.path.expanduser('~/.cache/authentik_api')
 
-        req_headers['Content-Type'] = 'application/json'
 
-        body = json.dumps(data).encode('utf-8') if data else None
-        request = urllib.request.Request(url, data=body, headers=req_headers, method=method)
+class AuthentikAPI(_authentik_client.Client):
+    """Client for Authentik API with bootstrapping support."""
 
-        # Create SSL context (don't verify for internal services)
-        ctx = ssl.create_default_context()
+    def __init__(self, base_url: str, token: Optional[str] = None,
+                 loopback_port: Optional[int] = None):
+        # Talk plain HTTP to the internal port when Authentik runs on this host
+        if loopback_port:
+            base_url = _authentik_client.loopback_url(base_url, loopback_port)
+        # Don't verify certificates for internal services.
         # For production, you'd want to verify certificates properly
         # But for automated deployments, we trust the internal network
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
+        super().__init__(base_url, token, verify=False)
+        self.session_cookie = None
 
-        try:
-            with urllib.request.urlopen(request, timeout=30, context=ctx) as response:
-                response_data = json.loads(response.read().decode('utf-8'))
-                # Capture session cookie if present
-                cookie = response.headers.get('Set-Cookie')
-                if cookie and not self.session_cookie:
-                    self.session_cookie = cookie.split(';')[0]
-                return response.status, response_data
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
-            try:
-                error_data = json.loads(error_body)
-            except json.JSONDecodeError:
-                error_data = {'error': error_body}
-            return e.code, error_data
-        except urllib.error.URLError as e:
-            return 0, {'error': str(e)}
+    def _request(self, method: str, path: str, data: Optional[Dict] = None,
+                 headers: Optional[Dict] = None,
+                 retries: int = _authentik_client.MAX_RETRIES) -> Tuple[int, Dict]:
+        """Make HTTP request to Authentik API."""
+        status, response_data, response_headers = self.send(method, path, data, headers, retries)
+
+        # Capture session cookie if present
+        cookie = response_headers.get('Set-Cookie')
+        if cookie and not self.session_cookie:
+            self.session_cookie = cookie.split(';')[0]
+            # The token, when present, takes precedence over the session cookie
+            if not self.token:
+                self._headers['Cookie'] = self.session_cookie
+        return status, response_data
 
     def wait_for_ready(self, timeout: int = 300) -> bool:
         """Wait for Authentik to be ready and responding."""
         print(f"Waiting for Authentik at {self.base_url} to be ready...", file=sys.stderr)
         start_time = time.time()
+        # Poll quickly at first so a running instance is detected almost immediately
+        delay = 0.25
+        method = 'HEAD'
 
         while time.time() - start_time < timeout:
             try:
-                status, _ = self._request('GET', '/')
+                # HEAD on a cheap JSON endpoint skips downloading a response body;
+                # no transport retries, this loop already paces the probes
+                status, _ = self._request(method, '/api/v3/root/config/', retries=0)
+                if status == 405 and method == 'HEAD':
+                    method = 'GET'
+                    continue
                 if status in [200, 302]:
                     print("Authentik is ready!", file=sys.stderr)
                     return True
             except Exception:
                 pass
 
-            time.sleep(5)
+            time.sleep(min(delay, max(0, timeout - (time.time() - start_time))))
+            delay = min(delay * 2, 5.0)
 
         print(f"Timeout waiting for Authentik after {timeout}s", file=sys.stderr)
         return False
@@ -114,8 +112,80 @@ class AuthentikAPI:
               file=sys.stderr)
         return False
 
+    def _token_cache_path(self, username: str) -> str:
+        key = hashlib.sha256(f"{self.base_url}{username}".encode('utf-8')).hexdigest()
+        return os.path.join(TOKEN_CACHE_DIR, f"{key}.json")
+
+    def _load_cached_token(self, username: str) -> Optional[str]:
+        """
+        Return a previously created token if it is still accepted by Authentik.
+
+        Returns None when there is no usable cached token and a new one should
+        be created. Raises ConnectionError when Authentik could not confirm
+        either way, so a flaky run does not mint (and leak) another token.
+        """
+        path = self._token_cache_path(username)
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(cached, dict):
+            cached = {}
+        expires_at = cached.get('expires_at')
+        token = cached.get('token')
+        if not token or (expires_at and expires_at <= time.time()):
+            # A concurrent run may already have removed it
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            return None
+
+        status, data, _ = _authentik_client.request(
+            'GET', f"{self.base_url}/api/v3/core/users/me/",
+            headers=_authentik_client.base_headers(token), verify=False)
+        if status == 200:
+            return token
+        if status in [401, 403]:
+            # Revoked or expired server-side; rotate
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            return None
+        raise ConnectionError(f"token check returned {status or 'no response'}: {data}")
+
+    def _store_cached_token(self, username: str, token: str, expires: Optional[str]) -> None:
+        """Cache a new token; failing to write the cache must not lose the token itself."""
+        expires_at = None
+        if expires:
+            try:
+                expires_at = datetime.fromisoformat(expires.replace('Z', '+00:00')).timestamp()
+            except ValueError:
+                pass
+
+        path = self._token_cache_path(username)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(TOKEN_CACHE_DIR, mode=0o700, exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'token': token, 'expires_at': expires_at}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"WARNING: Could not cache service account token: {e}", file=sys.stderr)
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+
     def create_service_account_token(self, username: str, password: str) -> Optional[str]:
-        """Login and create service account token."""
+        """Login and create service account token, reusing a cached one when still valid."""
+        try:
+            token = self._load_cached_token(username)
+        except ConnectionError as e:
+            print(f"ERROR: Could not verify cached service account token: {e}", file=sys.stderr)
+            return None
+        if token:
+            print("Reusing cached service account token", file=sys.stderr)
+            return token
+
         print("Creating service account token...", file=sys.stderr)
 
         # Try to authenticate
@@ -129,6 +199,9 @@ class AuthentikAPI:
         if status == 201:
             token = data.get('key')
             print("Service account token created successfully", file=sys.stderr)
+            if token:
+                self._store_cached_token(username, token,
+                                         data.get('expires') if data.get('expiring') else None)
             return token
         else:
             print(f"Failed to create token: {data}", file=sys.stderr)
@@ -136,24 +209,28 @@ class AuthentikAPI:
 
     def get_default_authorization_flow(self) -> Optional[str]:
         """Get the default authorization flow UUID."""
-        status, data = self._request('GET', '/api/v3/flows/instances/')
-
-        if status == 200:
-            for flow in data.get('results', []):
-                if flow.get('slug') == 'default-authorization-flow':
-                    return flow['pk']
-
-        # Fallback: get any authorization flow
-        for flow in data.get('results', []):
-            if flow.get('designation') == 'authorization':
-                return flow['pk']
+        # Let the server do the selection; the client-side match below only
+        # guards against a filter being ignored
+        status, data = self._request('GET', '/api/v3/flows/instances/?slug=default-authorization-flow')
+        results = data.get('results', []) if status == 200 else []
+
+        flow = next((f for f in results if f.get('slug') == 'default-authorization-flow'), None)
+        if not flow:
+            # Fallback: get any authorization flow
+            status, data = self._request(
+                'GET', '/api/v3/flows/instances/?designation=authorization&page_size=1')
+            results = data.get('results', []) if status == 200 else []
+            flow = next((f for f in results if f.get('designation') == 'authorization'), None)
+        if flow:
+            return flow['pk']
 
         print("ERROR: No authorization flow found", file=sys.stderr)
         return None
 
     def get_default_signing_key(self) -> Optional[str]:
         """Get the default signing key UUID."""
-        status, data = self._request('GET', '/api/v3/crypto/certificatekeypairs/')
+        # Only key pairs with a private key can sign tokens
+        status, data = self._request('GET', '/api/v3/crypto/certificatekeypairs/?has_key=true&page_size=1')
 
         if status == 200:
             results = data.get('results', [])
@@ -222,6 +299,12 @@ def main():
     parser.add_argument('--bootstrap-password', help='Bootstrap admin password')
     parser.add_argument('--bootstrap-email', default='admin@localhost', help='Bootstrap admin email')
     parser.add_argument('--wait-timeout', type=int, default=300, help='Timeout for waiting (seconds)')
+    parser.add_argument('--flow-uuid', help='Authorization flow UUID (skips lookup; see flow_uuid in output)')
+    parser.add_argument('--key-uuid', help='Signing key UUID (skips lookup; see key_uuid in output)')
+    parser.add_argument('--allow-http-loopback', action='store_true',
+                        help='Use plain HTTP on the internal port if the domain resolves to loopback')
+    parser.add_argument('--loopback-port', type=int, default=9000,
+                        help='Authentik internal HTTP port for --allow-http-loopback')
 
     args = parser.parse_args()
 
@@ -230,7 +313,8 @@ def main():
     launch_url = args.launch_url or args.redirect_uri.rsplit('/', 2)[0]
 
     # Initialize API client
-    api = AuthentikAPI(args.domain, args.token)
+    api = AuthentikAPI(args.domain, args.token,
+                       loopback_port=args.loopback_port if args.allow_http_loopback else None)
 
     # Wait for Authentik to be ready
     if not api.wait_for_ready(args.wait_timeout):
@@ -265,9 +349,16 @@ def main():
         print("ERROR: No API token provided and bootstrap needed", file=sys.stderr)
         sys.exit(1)
 
-    # Get required UUIDs
-    flow_uuid = api.get_default_authorization_flow()
-    key_uuid = api.get_default_signing_key()
+    # Get required UUIDs, only looking up the ones not passed on the command line
+    flow_uuid, key_uuid = args.flow_uuid, args.key_uuid
+    if not flow_uuid and not key_uuid:
+        # Independent lookups, fetched in parallel
+        flow_uuid, key_uuid = _authentik_client.run_concurrently(
+            api.get_default_authorization_flow, api.get_default_signing_key)
+    elif not flow_uuid:
+        flow_uuid = api.get_default_authorization_flow()
+    elif not key_uuid:
+        key_uuid = api.get_default_signing_key()
 
     if not flow_uuid or not key_uuid:
         print(json.dumps({'error': 'Failed to get required Authentik configuration'}))
@@ -292,6 +383,8 @@ def main():
         'application_id': application['pk'],
         'client_id': provider['client_id'],
         'client_secret': provider['client_secret'],
+        'flow_uuid': flow_uuid,
+        'key_uuid': key_uuid,
         'discovery_uri': f"{args.domain}/application/o/{app_slug}/.well-known/openid-configuration",
         'issuer': f"{args.domain}/application/o/{app_slug}/",
     }
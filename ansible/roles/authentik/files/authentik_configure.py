@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Configure Authentik flows and stages in a single process.
+
+Runs the configuration steps that configure_2fa_enforcement.py and
+configure_invitation_flow.py used to perform as separate processes, sharing one
+pooled API client so DNS, TLS and authentication are only set up once.
+
+Usage:
+    python3 authentik_configure.py --domain https://auth.example.com \
+                                   --token <api_token> \
+                                   [2fa] [invitation]
+
+Without explicit steps, all steps run in order.
+"""
+
+import argparse
+import json
+import sys
+from typing import Callable, Dict, List, Optional
+
+from _authentik_client import Client, run_concurrently
+
+
+class ConfigurationError(Exception):
+    """A configuration step failed; carries the API response for context."""
+
+    def __init__(self, message: str, details: Optional[Dict] = None):
+        super().__init__(message)
+        self.message = message
+        self.details = details
+
+    def to_dict(self) -> Dict:
+        error = {'error': self.message}
+        if self.details is not None:
+            error['details'] = self.details
+        return error
+
+
+class AuthentikConfigurator:
+    """Configuration steps sharing one Authentik API client."""
+
+    def __init__(self, client: Client):
+        self.client = client
+
+    def _get(self, path: str, error: str) -> Dict:
+        status, data = self.client.get(path)
+        if status != 200:
+            raise ConfigurationError(error, data)
+        return data
+
+    def _find(self, path: str, predicate: Callable[[Dict], bool], error: str) -> Optional[Dict]:
+        status, item = self.client.find(path, predicate)
+        if status != 200:
+            raise ConfigurationError(error, item)
+        return item
+
+    def configure_2fa(self) -> Dict:
+        """Force users to configure MFA via the default-authentication-mfa-validation stage."""
+        # Steps 1-2 are independent lookups, so run both at once. The server
+        # filters the listings; the predicates only guard against a filter
+        # being ignored.
+        mfa_stage, totp_setup_stage = run_concurrently(
+            # Step 1: Find the default MFA validation stage
+            lambda: self._find('/api/v3/stages/authenticator/validate/?name=default-authentication-mfa-validation',
+                               lambda s: 'default-authentication-mfa-validation' in s.get('name', '').lower(),
+                               'Failed to list authenticator validate stages'),
+            # Step 2: Find the default TOTP setup stage to use as configuration stage
+            lambda: self._find('/api/v3/stages/authenticator/totp/?search=setup',
+                               lambda s: 'setup' in s.get('name', '').lower(),
+                               'Failed to list TOTP setup stages'),
+        )
+
+        if not mfa_stage:
+            raise ConfigurationError('default-authentication-mfa-validation stage not found')
+
+        stage_pk = mfa_stage['pk']
+
+        if not totp_setup_stage:
+            raise ConfigurationError('TOTP setup stage not found')
+
+        totp_setup_pk = totp_setup_stage['pk']
+
+        # Skip the write on re-runs when enforcement is already in place
+        changed = not (mfa_stage.get('not_configured_action') == 'configure'
+                       and totp_setup_pk in mfa_stage.get('configuration_stages', []))
+
+        # Step 3: Update the MFA validation stage to force configuration
+        if changed:
+            update_data = {
+                'name': mfa_stage['name'],
+                'not_configured_action': 'configure',  # Force user to configure
+                'configuration_stages': [totp_setup_pk]  # Use TOTP setup stage
+            }
+
+            status, updated_stage = self.client.patch(
+                f'/api/v3/stages/authenticator/validate/{stage_pk}/', update_data)
+            if status not in [200, 201]:
+                raise ConfigurationError('Failed to update MFA validation stage', updated_stage)
+
+        return {
+            'success': True,
+            'changed': changed,
+            'message': '2FA enforcement configured' if changed else '2FA enforcement already configured',
+            'stage_name': mfa_stage['name'],
+            'stage_pk': stage_pk,
+            'note': 'Users will be forced to configure TOTP on login'
+        }
+
+    def configure_invitation_flow(self) -> Dict:
+        """Create an invitation stage and bind it to the default enrollment flow."""
+        # Step 1: Get the default enrollment flow
+        flows_response = self._get('/api/v3/flows/instances/?designation=enrollment&page_size=1',
+                                   'Failed to list flows')
+
+        enrollment_flow = next((f for f in flows_response.get('results', [])
+                               if f.get('designation') == 'enrollment'), None)
+
+        if not enrollment_flow:
+            raise ConfigurationError('No enrollment flow found')
+
+        flow_slug = enrollment_flow['slug']
+        flow_pk = enrollment_flow['pk']
+
+        # Step 2: Check if invitation stage already exists
+        stages_response = self._get('/api/v3/stages/invitation/?name=default-enrollment-invitation',
+                                    'Failed to list invitation stages')
+
+        invitation_stage = next((s for s in stages_response.get('results', [])
+                                if s.get('name') == 'default-enrollment-invitation'), None)
+
+        changed = False
+
+        # Step 3: Create invitation stage if it doesn't exist
+        if not invitation_stage:
+            stage_data = {
+                'name': 'default-enrollment-invitation',
+                'continue_flow_without_invitation': True
+            }
+            status, invitation_stage = self.client.post('/api/v3/stages/invitation/', stage_data)
+            if status not in [200, 201]:
+                raise ConfigurationError('Failed to create invitation stage', invitation_stage)
+            changed = True
+
+        stage_pk = invitation_stage['pk']
+
+        # Step 4: Check if the stage is already bound to the enrollment flow
+        bindings_response = self._get(f'/api/v3/flows/bindings/?target={flow_pk}&stage={stage_pk}',
+                                      'Failed to list flow bindings')
+
+        # Check if invitation stage is already bound
+        invitation_binding = next((b for b in bindings_response.get('results', [])
+                                  if b.get('stage') == stage_pk), None)
+
+        # Step 5: Bind the invitation stage to the enrollment flow if not already bound
+        if not invitation_binding:
+            binding_data = {
+                'target': flow_pk,
+                'stage': stage_pk,
+                'order': 0,  # Put invitation stage first
+                'evaluate_on_plan': True,
+                're_evaluate_policies': False
+            }
+            status, binding = self.client.post('/api/v3/flows/bindings/', binding_data)
+            if status not in [200, 201]:
+                raise ConfigurationError('Failed to bind invitation stage to flow', binding)
+            changed = True
+
+        return {
+            'success': True,
+            'changed': changed,
+            'message': 'Invitation flow configured',
+            'flow_slug': flow_slug,
+            'stage_pk': stage_pk,
+            'note': 'Invitation stage bound to enrollment flow'
+        }
+
+
+STEPS = {
+    '2fa': AuthentikConfigurator.configure_2fa,
+    'invitation': AuthentikConfigurator.configure_invitation_flow,
+}
+
+
+def run_step(base_url: str, token: str, step: str) -> None:
+    """Run a single step and print its result, for the per-step wrapper scripts."""
+    configurator = AuthentikConfigurator(Client(base_url, token))
+    try:
+        result = STEPS[step](configurator)
+    except ConfigurationError as e:
+        print(json.dumps(e.to_dict()), file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Configure Authentik flows and stages')
+    parser.add_argument('--domain', required=True, help='Authentik domain (https://auth.example.com)')
+    parser.add_argument('--token', required=True, help='Authentik API token')
+    parser.add_argument('steps', nargs='*', metavar='STEP',
+                        help=f"Steps to run, in order: {', '.join(STEPS)} (default: all)")
+
+    args = parser.parse_args()
+    steps: List[str] = args.steps or list(STEPS)
+    unknown = [s for s in steps if s not in STEPS]
+    if unknown:
+        parser.error(f"unknown step(s): {', '.join(unknown)}")
+
+    configurator = AuthentikConfigurator(Client(args.domain, args.token))
+
+    results = {}
+    for step in steps:
+        try:
+            results[step] = STEPS[step](configurator)
+        except ConfigurationError as e:
+            print(json.dumps({'step': step, **e.to_dict()}), file=sys.stderr)
+            sys.exit(1)
+
+    print(json.dumps({'success': True, 'steps': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()